@@ -2,8 +2,9 @@
 
 import os
 import sys
+from contextlib import asynccontextmanager
 
-from fastapi import FastAPI, UploadFile, File, HTTPException
+from fastapi import FastAPI, UploadFile, File, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from typing import List
@@ -13,7 +14,8 @@ import shutil
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
 from ingest import run_ingest, get_pdf_list
-from chat import chat
+from chat import chat_async
+from generation import close_backend
 
 # Calculate project root
 ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -22,7 +24,14 @@ PDF_FOLDER = os.path.join(ROOT_DIR, "pdf_inputs")
 # Ensure PDF folder exists
 os.makedirs(PDF_FOLDER, exist_ok=True)
 
-app = FastAPI(title="RAG Document Chat API")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    # Close pooled connections to the generation backend on shutdown
+    await close_backend()
+
+
+app = FastAPI(title="RAG Document Chat API", lifespan=lifespan)
 
 # CORS middleware for frontend
 app.add_middleware(
@@ -42,6 +51,8 @@ class ChatRequest(BaseModel):
 class ChatResponse(BaseModel):
     answer: str
     sources: List[dict]
+    model: str = ""
+    timings: dict = {}
 
 
 class IngestResponse(BaseModel):
@@ -132,13 +143,25 @@ async def ingest_documents():
 
 
 @app.post("/chat", response_model=ChatResponse)
-async def chat_endpoint(request: ChatRequest):
-    """Chat with the documents"""
+async def chat_endpoint(request: ChatRequest, http_request: Request):
+    """Chat with the documents
+
+    Work is cancelled if the client disconnects before the answer is ready.
+    """
     try:
-        response = chat(request.message, model=request.model)
+        response = await chat_async(
+            request.message,
+            model=request.model,
+            is_disconnected=http_request.is_disconnected,
+        )
         return response
     except Exception as e:
-        return {"answer": f"Error: {str(e)}", "sources": []}
+        return {
+            "answer": f"Error: {str(e)}",
+            "sources": [],
+            "model": request.model,
+            "timings": {},
+        }
 
 
 if __name__ == "__main__":
@@ -1,13 +1,40 @@
 # backend/chat.py
 
+import asyncio
 import os
-import requests
-from query import query_documents
+import re
+import time
 
-# Get Ollama host from environment (for Docker) or use default
-OLLAMA_HOST = os.getenv("OLLAMA_HOST", "http://localhost:11434")
-if not OLLAMA_HOST.startswith("http"):
-    OLLAMA_HOST = f"http://{OLLAMA_HOST}"
+from generation import (
+    PRIORITY_BACKGROUND,
+    PRIORITY_INTERACTIVE,
+    QUEUE_TIMEOUT,
+    REQUEST_TIMEOUT,
+    GenerationBusy,
+    close_backend,
+    generate,
+    preload,
+    route_model,
+)
+from query import embed_query, index_exists, load_vectorstore, search_by_vector
+
+# Number of extra query phrasings to retrieve with (0 disables expansion)
+QUERY_EXPANSION = int(os.getenv("QUERY_EXPANSION", "0"))
+
+# Per-stage deadlines in seconds. The generate deadline leaves room for the
+# queue wait plus the backend request, so a saturated model returns the busy
+# message rather than a stage timeout.
+STAGE_TIMEOUTS = {
+    "preload": 60,
+    "load": 60,
+    "rewrite": 20,
+    "embed": 30,
+    "search": 10,
+    "generate": QUEUE_TIMEOUT + REQUEST_TIMEOUT + 5,
+}
+
+# How often to check whether the client has gone away
+DISCONNECT_POLL_INTERVAL = 0.5
 
 SYSTEM_PROMPT = """You are a helpful AI assistant that answers questions based on the provided document context.
 
@@ -19,6 +46,12 @@ Your responses should be:
 If the answer is not found in the context, say: "I couldn't find that information in the uploaded documents."
 """
 
+REWRITE_PROMPT = """Rewrite the question below in {n} different ways that could help find the answer in a document search.
+Return only the rewritten questions, one per line, with no numbering or extra text.
+
+QUESTION:
+{question}"""
+
 
 def build_prompt(question: str, context_chunks: list) -> str:
     """Build the prompt with context and question"""
@@ -37,48 +70,218 @@ USER QUESTION:
 Please answer the question based on the context above."""
 
 
-def generate_response(prompt: str, model: str = "qwen3:4b") -> str:
-    """Generate response using Ollama API"""
+async def generate_response(
+    prompt: str, model: str = "qwen3:4b", priority: int = PRIORITY_INTERACTIVE
+) -> str:
+    """Generate response using the configured generation backend"""
     try:
-        response = requests.post(
-            f"{OLLAMA_HOST}/api/generate",
-            json={"model": model, "prompt": prompt, "stream": False},
-            timeout=120,
-        )
-        response.raise_for_status()
-        return response.json().get("response", "").strip()
+        return await generate(prompt, model, priority=priority)
+    except GenerationBusy:
+        return "The model is busy right now. Please try again in a moment."
     except Exception as e:
         return f"Error generating response: {str(e)}"
 
 
-def chat(question: str, model: str = "qwen3:4b", top_k: int = 4) -> dict:
-    """Main chat function - retrieves context and generates response"""
-    # Retrieve relevant chunks
-    chunks = query_documents(question, top_k=top_k)
+async def preload_model(model: str) -> None:
+    """Ask the backend to load the model into memory without generating anything"""
+    await preload(model)
+
+
+async def rewrite_query(question: str, model: str, n: int) -> list:
+    """Ask the model for alternative phrasings of the question"""
+    # Rewrites are optional, so they queue behind interactive requests
+    try:
+        text = await generate(
+            REWRITE_PROMPT.format(n=n, question=question),
+            model,
+            priority=PRIORITY_BACKGROUND,
+            timeout=STAGE_TIMEOUTS["rewrite"],
+        )
+    except Exception:
+        return []
+
+    # Drop any reasoning block and list markers the model adds anyway
+    text = re.sub(r"<think>.*?</think>", "", text, flags=re.DOTALL)
+    rewrites = []
+    for line in text.splitlines():
+        line = re.sub(r"^\s*(?:[-*]|\d+[.)])\s*", "", line).strip()
+        if line and line.lower() != question.lower() and line not in rewrites:
+            rewrites.append(line)
+    return rewrites[:n]
+
+
+def merge_results(result_lists: list, top_k: int) -> list:
+    """Merge retrievals from several queries, keeping the best score per chunk"""
+    best = {}
+    for results in result_lists:
+        for r in results:
+            key = (r["pdf"], r["page"], r["text"])
+            # FAISS returns L2 distances, so lower is better
+            if key not in best or r["score"] < best[key]["score"]:
+                best[key] = r
+    return sorted(best.values(), key=lambda r: r["score"])[:top_k]
+
+
+async def _run_stage(timings: dict, stage: str, func, *args):
+    """Run a stage under its deadline and time it
+
+    Coroutine functions are awaited directly so a missed deadline cancels them;
+    blocking functions run in a worker thread.
+    """
+    if asyncio.iscoroutinefunction(func):
+        work = func(*args)
+    else:
+        work = asyncio.to_thread(func, *args)
+
+    start = time.perf_counter()
+    try:
+        return await asyncio.wait_for(work, timeout=STAGE_TIMEOUTS[stage])
+    except asyncio.TimeoutError:
+        raise TimeoutError(
+            f"{stage} stage exceeded {STAGE_TIMEOUTS[stage]}s deadline"
+        ) from None
+    finally:
+        # Concurrent runs of the same stage report the slowest one
+        elapsed = round((time.perf_counter() - start) * 1000, 1)
+        timings[f"{stage}_ms"] = max(timings.get(f"{stage}_ms", 0), elapsed)
+
+
+async def _retrieve(timings: dict, query: str, top_k: int, record: bool = False) -> list:
+    """Embed a single query and search the vectorstore with it
+
+    record marks the user's own question so it counts towards cache warming.
+    """
+    embedding = await _run_stage(timings, "embed", embed_query, query)
+    return await _run_stage(
+        timings, "search", search_by_vector, embedding, top_k, query, record
+    )
+
+
+async def _expanded_retrieve(timings: dict, question: str, model: str, top_k: int) -> list:
+    """Retrieve with the rewritten queries, started as soon as the rewrite returns"""
+    try:
+        rewrites = await _run_stage(
+            timings, "rewrite", rewrite_query, question, model, QUERY_EXPANSION
+        )
+    except TimeoutError:
+        # Expansion is best effort; the original query still answers
+        return []
+    results = await asyncio.gather(
+        *(_retrieve(timings, q, top_k) for q in rewrites), return_exceptions=True
+    )
+    return [r for r in results if not isinstance(r, BaseException)]
+
+
+def _discard(task: asyncio.Task) -> None:
+    """Cancel a background task and silence any error it finished with"""
+    if not task.done():
+        task.cancel()
+    task.add_done_callback(lambda t: t.cancelled() or t.exception())
 
-    if not chunks:
+
+async def _pipeline(question: str, model: str, top_k: int, timings: dict) -> dict:
+    """Run retrieval, model preload and optional query expansion concurrently"""
+    start = time.perf_counter()
+
+    if not index_exists():
         return {
             "answer": "No documents have been uploaded yet. Please upload some PDFs first.",
             "sources": [],
+            "model": model,
+            "timings": timings,
         }
 
-    # Build prompt and generate response
-    prompt = build_prompt(question, chunks)
-    answer = generate_response(prompt, model)
+    # Loading the model and the FAISS index both take seconds on a cold start, so
+    # run them alongside the query embedding. A search that gets ahead of the
+    # index load waits for it inside load_vectorstore.
+    preload = asyncio.create_task(_run_stage(timings, "preload", preload_model, model))
+    try:
+        retrievals = [
+            _run_stage(timings, "load", load_vectorstore),
+            _retrieve(timings, question, top_k, record=True),
+        ]
+        if QUERY_EXPANSION > 0:
+            retrievals.append(_expanded_retrieve(timings, question, model, top_k))
+        _, primary, *expanded = await asyncio.gather(*retrievals)
+        chunks = merge_results([primary, *(expanded[0] if expanded else [])], top_k)
+        timings["retrieve_ms"] = round((time.perf_counter() - start) * 1000, 1)
+
+        # Build prompt and generate response
+        prompt = build_prompt(question, chunks)
+        answer = await _run_stage(timings, "generate", generate_response, prompt, model)
+    finally:
+        _discard(preload)
+
+    # Format sources - deduplicate by (pdf, page) combination, keeping order
+    sources = [
+        {"pdf": pdf, "page": page}
+        for pdf, page in dict.fromkeys((c["pdf"], c["page"]) for c in chunks)
+    ]
+
+    return {"answer": answer, "sources": sources, "model": model, "timings": timings}
+
+
+async def _cancel_on_disconnect(is_disconnected, task: asyncio.Task) -> bool:
+    """Cancel the pipeline once the client has disconnected"""
+    while not task.done():
+        if await is_disconnected():
+            task.cancel()
+            return True
+        await asyncio.sleep(DISCONNECT_POLL_INTERVAL)
+    return False
+
+
+async def chat_async(
+    question: str, model: str = "qwen3:4b", top_k: int = 4, is_disconnected=None
+) -> dict:
+    """Pipelined chat - cancelled early if is_disconnected() reports the client left
+
+    Stage failures are returned as an error answer that still carries the
+    timings gathered so far.
+    """
+    timings = {}
+    start = time.perf_counter()
+    model = route_model(question, model)
+
+    pipeline = asyncio.create_task(_pipeline(question, model, top_k, timings))
+    watcher = None
+    if is_disconnected is not None:
+        watcher = asyncio.create_task(_cancel_on_disconnect(is_disconnected, pipeline))
+    try:
+        return await pipeline
+    except asyncio.CancelledError:
+        # Only swallow our own cancellation; anything else (e.g. shutdown) propagates
+        if watcher is None or not watcher.done() or watcher.cancelled() or not watcher.result():
+            raise
+        return {
+            "answer": "Request cancelled because the client disconnected.",
+            "sources": [],
+            "model": model,
+            "timings": timings,
+        }
+    except Exception as e:
+        return {"answer": f"Error: {str(e)}", "sources": [], "model": model, "timings": timings}
+    finally:
+        timings["total_ms"] = round((time.perf_counter() - start) * 1000, 1)
+        if watcher is not None:
+            watcher.cancel()
+
+
+def chat(question: str, model: str = "qwen3:4b", top_k: int = 4) -> dict:
+    """Main chat function - retrieves context and generates response"""
 
-    # Format sources - deduplicate by (pdf, page) combination
-    seen = set()
-    sources = []
-    for c in chunks:
-        source_key = (c["pdf"], c["page"])
-        if source_key not in seen:
-            seen.add(source_key)
-            sources.append({"pdf": c["pdf"], "page": c["page"]})
+    async def run_once():
+        try:
+            return await chat_async(question, model=model, top_k=top_k)
+        finally:
+            # The event loop ends with this call, so close its connections too
+            await close_backend()
 
-    return {"answer": answer, "sources": sources}
+    return asyncio.run(run_once())
 
 
 if __name__ == "__main__":
     response = chat("Where did Rajiv Battula work in 2015?")
     print(response["answer"])
     print("\nSources:", response["sources"])
+    print("Timings:", response["timings"])
@@ -0,0 +1,329 @@
+# backend/generation.py
+
+import asyncio
+import heapq
+import itertools
+import os
+from abc import ABC, abstractmethod
+
+import httpx
+
+# Get Ollama host from environment (for Docker) or use default
+OLLAMA_HOST = os.getenv("OLLAMA_HOST", "http://localhost:11434")
+if not OLLAMA_HOST.startswith("http"):
+    OLLAMA_HOST = f"http://{OLLAMA_HOST}"
+
+# How long Ollama keeps a model loaded after a preload or generation
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "10m")
+
+# Which backend serves generation: "ollama", "openai" (any OpenAI-compatible server) or "fake"
+GENERATION_BACKEND = os.getenv("GENERATION_BACKEND", "ollama")
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL", "http://localhost:8080/v1").rstrip("/")
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "")
+
+# Model routing - both must be set to enable it
+SMALL_MODEL = os.getenv("SMALL_MODEL", "")
+LARGE_MODEL = os.getenv("LARGE_MODEL", "")
+# Questions longer than this many characters go to the large model
+ROUTE_LENGTH_THRESHOLD = int(os.getenv("ROUTE_LENGTH_THRESHOLD", "200"))
+
+# Concurrent requests allowed per model, and how long a request may wait for a slot
+MODEL_CONCURRENCY = int(os.getenv("MODEL_CONCURRENCY", "2"))
+QUEUE_TIMEOUT = float(os.getenv("QUEUE_TIMEOUT", "20"))
+# Seconds allowed for the backend call itself once a slot is held
+REQUEST_TIMEOUT = float(os.getenv("REQUEST_TIMEOUT", "120"))
+
+# Lower values are served first
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 1
+
+
+class GenerationBusy(Exception):
+    """Raised when no model slot frees up within the queue timeout"""
+
+
+class ModelGate:
+    """Concurrency cap for one model, serving waiters by priority then arrival
+
+    Slots are held by coroutines, so cancelling a waiting or running request
+    gives its place back immediately.
+    """
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.active = 0
+        self._waiting = []
+        self._counter = itertools.count()
+
+    @property
+    def load(self) -> int:
+        """Requests running plus requests queued"""
+        return self.active + len(self._waiting)
+
+    async def acquire(self, priority: int = PRIORITY_INTERACTIVE, timeout: float = QUEUE_TIMEOUT):
+        if self.active < self.limit and not self._waiting:
+            self.active += 1
+            return
+        if timeout <= 0:
+            raise GenerationBusy("no generation slot free")
+
+        future = asyncio.get_running_loop().create_future()
+        entry = (priority, next(self._counter), future)
+        heapq.heappush(self._waiting, entry)
+        try:
+            await asyncio.wait_for(future, timeout)
+        except BaseException as e:
+            if future.done() and not future.cancelled():
+                # The slot was handed over just as we gave up, so pass it on
+                self.release()
+            elif entry in self._waiting:
+                self._waiting.remove(entry)
+                heapq.heapify(self._waiting)
+            if isinstance(e, asyncio.TimeoutError):
+                raise GenerationBusy(f"no generation slot free after {timeout:g}s") from None
+            raise
+
+    def release(self):
+        # Hand the slot straight to the next live waiter, if any
+        while self._waiting:
+            _, _, future = heapq.heappop(self._waiting)
+            if not future.done():
+                future.set_result(None)
+                return
+        self.active -= 1
+
+
+class GenerationBackend(ABC):
+    """Base class for text generation backends"""
+
+    @abstractmethod
+    async def generate(self, prompt: str, model: str) -> str:
+        """Return the completion for a prompt"""
+
+    async def preload(self, model: str) -> None:
+        """Load the model ahead of a request; a no-op where not supported"""
+
+    async def aclose(self) -> None:
+        """Release any open connections"""
+
+
+class HTTPBackend(GenerationBackend):
+    """Backend talking to a server over a reused async connection pool
+
+    Cancelling a request closes its connection, which tells the server to stop
+    generating for it.
+    """
+
+    def __init__(self, base_url: str, headers: dict = None):
+        self.base_url = base_url
+        self.headers = headers or {}
+        self._client = None
+        self._client_loop = None
+
+    async def _get_client(self) -> httpx.AsyncClient:
+        # Connections belong to the event loop that opened them
+        loop = asyncio.get_running_loop()
+        if self._client is not None and self._client_loop is not loop:
+            await self.aclose()
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url, headers=self.headers, timeout=REQUEST_TIMEOUT
+            )
+            self._client_loop = loop
+        return self._client
+
+    async def aclose(self) -> None:
+        client, self._client, self._client_loop = self._client, None, None
+        if client is not None:
+            try:
+                await client.aclose()
+            except RuntimeError:
+                # Its event loop is already closed, which took the sockets with it
+                pass
+
+
+class OllamaBackend(HTTPBackend):
+    """Ollama HTTP API"""
+
+    def __init__(self, host: str = OLLAMA_HOST, keep_alive: str = OLLAMA_KEEP_ALIVE):
+        super().__init__(host)
+        self.keep_alive = keep_alive
+
+    async def generate(self, prompt: str, model: str) -> str:
+        client = await self._get_client()
+        response = await client.post(
+            "/api/generate",
+            json={
+                "model": model,
+                "prompt": prompt,
+                "stream": False,
+                "keep_alive": self.keep_alive,
+            },
+        )
+        response.raise_for_status()
+        return response.json().get("response", "").strip()
+
+    async def preload(self, model: str) -> None:
+        # A request without a prompt only loads the model
+        client = await self._get_client()
+        response = await client.post(
+            "/api/generate", json={"model": model, "keep_alive": self.keep_alive}
+        )
+        response.raise_for_status()
+
+
+class OpenAICompatBackend(HTTPBackend):
+    """Any server exposing the OpenAI chat completions API (llama.cpp, vLLM, LM Studio...)"""
+
+    def __init__(self, base_url: str = OPENAI_BASE_URL, api_key: str = OPENAI_API_KEY):
+        headers = {"Authorization": f"Bearer {api_key}"} if api_key else {}
+        super().__init__(base_url, headers)
+
+    async def generate(self, prompt: str, model: str) -> str:
+        client = await self._get_client()
+        response = await client.post(
+            "/chat/completions",
+            json={
+                "model": model,
+                "messages": [{"role": "user", "content": prompt}],
+                "stream": False,
+            },
+        )
+        response.raise_for_status()
+        choices = response.json().get("choices") or [{}]
+        return (choices[0].get("message", {}).get("content") or "").strip()
+
+
+class FakeBackend(GenerationBackend):
+    """In-process backend for tests - returns a fixed reply and records calls"""
+
+    def __init__(self, reply: str = "fake response", delay: float = 0.0):
+        self.reply = reply
+        self.delay = delay
+        self.calls = []
+
+    async def generate(self, prompt: str, model: str) -> str:
+        self.calls.append((model, prompt))
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        return self.reply
+
+    async def preload(self, model: str) -> None:
+        self.calls.append((model, None))
+
+
+BACKENDS = {
+    "ollama": OllamaBackend,
+    "openai": OpenAICompatBackend,
+    "fake": FakeBackend,
+}
+
+_backend = None
+_gates = {}
+# Requests in flight, keyed by (model, prompt), so identical prompts share one call
+_inflight = {}
+
+
+def get_backend() -> GenerationBackend:
+    """Return the configured backend, creating it on first use"""
+    global _backend
+    if _backend is None:
+        if GENERATION_BACKEND not in BACKENDS:
+            raise ValueError(f"Unknown GENERATION_BACKEND: {GENERATION_BACKEND}")
+        _backend = BACKENDS[GENERATION_BACKEND]()
+    return _backend
+
+
+def set_backend(backend: GenerationBackend) -> None:
+    """Replace the active backend (e.g. with a FakeBackend in tests)"""
+    global _backend
+    _backend = backend
+
+
+def get_gate(model: str) -> ModelGate:
+    """Return the concurrency gate for a model"""
+    if model not in _gates:
+        _gates[model] = ModelGate(MODEL_CONCURRENCY)
+    return _gates[model]
+
+
+def route_model(question: str, model: str) -> str:
+    """Pick the small or large model for a question
+
+    Long questions go to the large model unless it is already saturated, in which
+    case they fall back to the small one. Without SMALL_MODEL and LARGE_MODEL set
+    the requested model is used as is.
+    """
+    if not (SMALL_MODEL and LARGE_MODEL):
+        return model
+
+    if len(question) <= ROUTE_LENGTH_THRESHOLD:
+        return SMALL_MODEL
+    if get_gate(LARGE_MODEL).load >= MODEL_CONCURRENCY:
+        return SMALL_MODEL
+    return LARGE_MODEL
+
+
+async def generate(
+    prompt: str, model: str, priority: int = PRIORITY_INTERACTIVE, timeout: float = None
+) -> str:
+    """Generate a completion, waiting for a free slot on the model
+
+    timeout is the caller's remaining budget in seconds; the queue wait plus the
+    request never exceed it. Defaults to QUEUE_TIMEOUT + REQUEST_TIMEOUT.
+
+    Concurrent calls with the same model and prompt are coalesced into one
+    backend request, run with the first caller's priority and budget. It is
+    only cancelled once every caller waiting on it has gone.
+    """
+    key = (model, prompt)
+    shared = _inflight.get(key)
+    if shared is None:
+        task = asyncio.ensure_future(_generate_once(prompt, model, priority, timeout))
+        shared = _inflight[key] = {"task": task, "waiters": 0}
+        task.add_done_callback(lambda _: _forget(key, shared))
+
+    shared["waiters"] += 1
+    try:
+        return await asyncio.shield(shared["task"])
+    finally:
+        shared["waiters"] -= 1
+        if shared["waiters"] == 0 and not shared["task"].done():
+            # Nobody is left to read the answer; stop it and let new callers start afresh
+            _forget(key, shared)
+            shared["task"].cancel()
+            # Let it unwind so its model slot is free by the time we return
+            await asyncio.wait([shared["task"]])
+
+
+def _forget(key: tuple, shared: dict) -> None:
+    if _inflight.get(key) is shared:
+        del _inflight[key]
+
+
+async def _generate_once(prompt: str, model: str, priority: int, timeout: float) -> str:
+    loop = asyncio.get_running_loop()
+    budget = QUEUE_TIMEOUT + REQUEST_TIMEOUT if timeout is None else timeout
+    started = loop.time()
+
+    gate = get_gate(model)
+    await gate.acquire(priority, min(QUEUE_TIMEOUT, budget))
+    try:
+        remaining = min(REQUEST_TIMEOUT, budget - (loop.time() - started))
+        try:
+            return await asyncio.wait_for(get_backend().generate(prompt, model), remaining)
+        except asyncio.TimeoutError:
+            raise TimeoutError(f"{model} did not respond within {remaining:.0f}s") from None
+    finally:
+        gate.release()
+
+
+async def preload(model: str) -> None:
+    """Load a model ahead of use without taking a generation slot"""
+    await get_backend().preload(model)
+
+
+async def close_backend() -> None:
+    """Close the active backend's connections (on shutdown or after a one-off run)"""
+    if _backend is not None:
+        await _backend.aclose()
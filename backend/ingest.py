@@ -1,12 +1,14 @@
 # backend/ingest.py
 
 import os
+import threading
 
 import shutil
 from langchain_community.document_loaders import PyPDFLoader, PyMuPDFLoader
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_community.vectorstores import FAISS
 from langchain_ollama import OllamaEmbeddings
+from query import publish_index, warm_retrieval_cache
 
 # Get Ollama host from environment (for Docker) or use default
 OLLAMA_HOST = os.getenv("OLLAMA_HOST", "http://localhost:11434")
@@ -81,6 +83,10 @@ def run_ingest():
     # Build FAISS vectorstore
     vectorstore = FAISS.from_documents(chunks, embeddings)
     vectorstore.save_local(VECTORSTORE_FOLDER)
+    publish_index()
+
+    # Replay popular queries against the new index in the background
+    threading.Thread(target=warm_retrieval_cache, daemon=True).start()
 
     print("✅ Ingestion complete!\n")
 
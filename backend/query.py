@@ -1,7 +1,10 @@
 # backend/query.py
 
 import os
+import threading
+from collections import OrderedDict
 
+import numpy as np
 from langchain_community.vectorstores import FAISS
 from langchain_ollama import OllamaEmbeddings
 
@@ -11,32 +14,104 @@ OLLAMA_HOST = os.getenv("OLLAMA_HOST", "http://localhost:11434")
 # Calculate project root
 ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 VECTORSTORE_FOLDER = os.path.join(ROOT_DIR, "vectorstore")
+INDEX_FILE = os.path.join(VECTORSTORE_FOLDER, "index.faiss")
 
+# Reuse a cached retrieval when a new query embedding is at least this similar.
+# Kept strict: questions that differ in a single entity ("2015" vs "2017") can
+# score above 0.95 with mxbai-embed-large.
+RETRIEVAL_CACHE_THRESHOLD = float(os.getenv("RETRIEVAL_CACHE_THRESHOLD", "0.98"))
+RETRIEVAL_CACHE_SIZE = int(os.getenv("RETRIEVAL_CACHE_SIZE", "256"))
+# Number of most frequent queries replayed after each ingest
+RETRIEVAL_WARM_TOP_N = int(os.getenv("RETRIEVAL_WARM_TOP_N", "20"))
 
-def load_vectorstore():
-    """Load the FAISS vectorstore"""
-    if not os.path.exists(VECTORSTORE_FOLDER):
+# Loaded once and reused until ingest writes a new index. The generation counts
+# loads and tags cache entries with the index they were computed against.
+_embeddings = None
+_vectorstore = None
+_vectorstore_mtime = None
+_vectorstore_generation = 0
+_vectorstore_lock = threading.Lock()
+
+# Retrieval cache. Each entry owns a row of a preallocated matrix of normalized
+# query embeddings and is tagged with the index generation it was computed
+# against. A top_k of 0 marks a free row.
+_cache_rows = OrderedDict()  # query text -> row, least recently used first
+_cache_keys = [None] * RETRIEVAL_CACHE_SIZE
+_cache_results = [None] * RETRIEVAL_CACHE_SIZE
+_cache_matrix = None  # allocated on first store, once the embedding size is known
+_cache_generation = np.zeros(RETRIEVAL_CACHE_SIZE, dtype=np.int64)
+_cache_top_k = np.zeros(RETRIEVAL_CACHE_SIZE, dtype=np.int32)
+# Query popularity: query text -> [count, top_k, normalized float32 embedding]
+_query_stats = {}
+_cache_lock = threading.Lock()
+
+
+def get_embeddings():
+    """Return the shared embeddings client"""
+    global _embeddings
+    if _embeddings is None:
+        _embeddings = OllamaEmbeddings(
+            model="mxbai-embed-large",
+            base_url=OLLAMA_HOST if OLLAMA_HOST.startswith("http") else f"http://{OLLAMA_HOST}"
+        )
+    return _embeddings
+
+
+def _index_mtime():
+    """Modification time of the saved index, or None if there is no index"""
+    try:
+        return os.stat(INDEX_FILE).st_mtime_ns
+    except OSError:
         return None
 
-    embeddings = OllamaEmbeddings(
-        model="mxbai-embed-large",
-        base_url=OLLAMA_HOST if OLLAMA_HOST.startswith("http") else f"http://{OLLAMA_HOST}"
-    )
-    vectorstore = FAISS.load_local(
-        VECTORSTORE_FOLDER, embeddings, allow_dangerous_deserialization=True
-    )
-    return vectorstore
 
+def index_exists() -> bool:
+    """Cheap check for a saved index, without loading it"""
+    return os.path.exists(INDEX_FILE)
 
-def query_documents(query: str, top_k: int = 4):
-    """Query the vectorstore and return results"""
-    vectorstore = load_vectorstore()
 
-    if vectorstore is None:
-        return []
+def _load_vectorstore_with_generation():
+    """Return (vectorstore, generation), reloading only when the index changes"""
+    global _vectorstore, _vectorstore_mtime, _vectorstore_generation
+
+    mtime = _index_mtime()
+    if mtime is None:
+        return None, None
+
+    with _vectorstore_lock:
+        if _vectorstore is None or mtime != _vectorstore_mtime:
+            _vectorstore = FAISS.load_local(
+                VECTORSTORE_FOLDER, get_embeddings(), allow_dangerous_deserialization=True
+            )
+            _vectorstore_mtime = mtime
+            _vectorstore_generation += 1
+        return _vectorstore, _vectorstore_generation
+
+
+def publish_index():
+    """Mark the index as rebuilt so the next load picks it up
 
-    results = vectorstore.similarity_search_with_score(query, k=top_k)
+    Ingest calls this after saving, because two rebuilds inside one filesystem
+    timestamp tick leave the mtime unchanged. The mtime check still catches
+    rebuilds done by another process.
+    """
+    global _vectorstore
+    with _vectorstore_lock:
+        _vectorstore = None
 
+
+def load_vectorstore():
+    """Load the FAISS vectorstore, reloading only when the index changes"""
+    return _load_vectorstore_with_generation()[0]
+
+
+def embed_query(query: str) -> list:
+    """Embed a query string"""
+    return get_embeddings().embed_query(query)
+
+
+def format_results(results) -> list:
+    """Convert (Document, score) pairs into plain dicts"""
     formatted_results = []
     for doc, score in results:
         formatted_results.append(
@@ -47,10 +122,149 @@ def query_documents(query: str, top_k: int = 4):
                 "score": float(score),
             }
         )
+    return formatted_results
+
+
+def _normalize(embedding) -> np.ndarray:
+    vector = np.asarray(embedding, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+def _record_query(query: str, top_k: int, vector: np.ndarray) -> None:
+    """Count a query so the most popular ones can be replayed after ingest"""
+    with _cache_lock:
+        stats = _query_stats.get(query)
+        if stats is None:
+            _query_stats[query] = [1, top_k, vector]
+        else:
+            stats[0] += 1
+            stats[1] = max(stats[1], top_k)
+
+        # Keep the table bounded by dropping the least popular queries
+        if len(_query_stats) > RETRIEVAL_CACHE_SIZE * 4:
+            keep = sorted(_query_stats.items(), key=lambda kv: kv[1][0], reverse=True)
+            _query_stats.clear()
+            _query_stats.update(keep[:RETRIEVAL_CACHE_SIZE])
+
+
+def _cache_lookup(vector: np.ndarray, top_k: int, generation: int):
+    """Return (query, results) for the closest cached query above the threshold, if any"""
+    with _cache_lock:
+        if _cache_matrix is None or not _cache_rows:
+            return None
+
+        similarities = _cache_matrix @ vector
+        similarities[(_cache_generation != generation) | (_cache_top_k < top_k)] = -np.inf
+        best = int(np.argmax(similarities))
+        if similarities[best] < RETRIEVAL_CACHE_THRESHOLD:
+            return None
 
+        _cache_rows.move_to_end(_cache_keys[best])
+        return _cache_keys[best], _cache_results[best][:top_k]
+
+
+def _free_rows(rows) -> None:
+    for row in rows:
+        del _cache_rows[_cache_keys[row]]
+        _cache_keys[row] = None
+        _cache_results[row] = None
+        _cache_top_k[row] = 0
+
+
+def _cache_store(query: str, vector: np.ndarray, top_k: int, generation: int, results: list):
+    global _cache_matrix
+
+    with _cache_lock:
+        current = _vectorstore_generation
+        # Results computed against an index that has since been replaced are stale,
+        # and only then is it safe to drop every row not from the current index
+        if generation != current:
+            return
+        _free_rows(np.flatnonzero((_cache_top_k > 0) & (_cache_generation != current)))
+
+        if _cache_matrix is None:
+            _cache_matrix = np.zeros((RETRIEVAL_CACHE_SIZE, len(vector)), dtype=np.float32)
+
+        row = _cache_rows.get(query)
+        if row is None:
+            free = np.flatnonzero(_cache_top_k == 0)
+            if len(free):
+                row = int(free[0])
+            else:
+                _, row = _cache_rows.popitem(last=False)
+            _cache_rows[query] = row
+            _cache_keys[row] = query
+        _cache_rows.move_to_end(query)
+
+        _cache_matrix[row] = vector
+        _cache_generation[row] = generation
+        _cache_top_k[row] = top_k
+        _cache_results[row] = results
+
+
+def search_by_vector(embedding: list, top_k: int = 4, query: str = None, record: bool = False):
+    """Search the vectorstore with an already computed query embedding
+
+    When the query text is given, results are served from and stored in the
+    retrieval cache. Only queries searched with record=True (the user's own
+    question, not generated rewrites) count towards cache warming.
+    """
+    vectorstore, generation = _load_vectorstore_with_generation()
+
+    if vectorstore is None:
+        return []
+
+    vector = _normalize(embedding)
+    if query is not None:
+        query = " ".join(query.lower().split())
+        cached = _cache_lookup(vector, top_k, generation)
+        if record:
+            # A paraphrase counts toward the cached query it matched, so one
+            # popular question is not split across its wordings
+            _record_query(cached[0] if cached else query, top_k, vector)
+        if cached is not None:
+            return cached[1]
+
+    results = vectorstore.similarity_search_with_score_by_vector(embedding, k=top_k)
+    formatted_results = format_results(results)
+
+    if query is not None:
+        _cache_store(query, vector, top_k, generation, formatted_results)
     return formatted_results
 
 
+def warm_retrieval_cache(top_n: int = RETRIEVAL_WARM_TOP_N) -> int:
+    """Replay the most frequent queries against the current index
+
+    Called after ingest publishes a new index so the first users after a
+    rebuild hit a warm cache. Returns the number of queries replayed.
+    """
+    vectorstore, generation = _load_vectorstore_with_generation()
+    if vectorstore is None:
+        return 0
+
+    with _cache_lock:
+        popular = sorted(_query_stats.items(), key=lambda kv: kv[1][0], reverse=True)
+        popular = [(q, k, emb) for q, (_, k, emb) in popular[:top_n]]
+
+    # Embeddings from Ollama are unit length, so replaying the normalized vector
+    # scores the same as the original query did
+    for query, top_k, vector in popular:
+        results = vectorstore.similarity_search_with_score_by_vector(vector, k=top_k)
+        _cache_store(query, vector, top_k, generation, format_results(results))
+
+    return len(popular)
+
+
+def query_documents(query: str, top_k: int = 4):
+    """Query the vectorstore and return results"""
+    if load_vectorstore() is None:
+        return []
+
+    return search_by_vector(embed_query(query), top_k=top_k, query=query, record=True)
+
+
 if __name__ == "__main__":
     results = query_documents("Where did Jaime Quezada work in 2017?")
     for i, r in enumerate(results):
@@ -0,0 +1,103 @@
+# backend/test_chat.py
+
+import asyncio
+
+import pytest
+
+import chat
+import generation
+from generation import FakeBackend
+
+CHUNK = {"pdf": "a.pdf", "page": 1, "text": "context", "score": 0.5}
+
+
+@pytest.fixture(autouse=True)
+def fake_pipeline(monkeypatch):
+    """Stub retrieval and give every test fresh gates and a fake backend"""
+    monkeypatch.setattr(generation, "_gates", {})
+    monkeypatch.setattr(generation, "_inflight", {})
+    monkeypatch.setattr(chat, "index_exists", lambda: True)
+    monkeypatch.setattr(chat, "load_vectorstore", lambda: object())
+    monkeypatch.setattr(chat, "embed_query", lambda query: [1.0, 0.0])
+    monkeypatch.setattr(
+        chat, "search_by_vector", lambda embedding, top_k, query=None, record=False: [CHUNK]
+    )
+    backend = FakeBackend()
+    generation.set_backend(backend)
+    yield backend
+    generation.set_backend(None)
+
+
+def test_merge_results_keeps_best_score_per_chunk():
+    a = {"pdf": "a.pdf", "page": 1, "text": "a", "score": 0.9}
+    a_better = dict(a, score=0.2)
+    b = {"pdf": "b.pdf", "page": 2, "text": "b", "score": 0.5}
+    c = {"pdf": "c.pdf", "page": 3, "text": "c", "score": 0.7}
+
+    merged = chat.merge_results([[a, b], [a_better, c]], top_k=2)
+
+    assert merged == [a_better, b]
+
+
+def test_rewrite_query_parses_model_output(fake_pipeline):
+    fake_pipeline.reply = (
+        "<think>\nLet me think about this.\n</think>\n"
+        "1. Who employed Jaime in 2015?\n"
+        "- Where did Jaime work in 2015?\n"
+        "* Which company did Jaime work for in 2015?\n"
+        "2) Who employed Jaime in 2015?\n"
+    )
+
+    rewrites = asyncio.run(chat.rewrite_query("Where did Jaime work in 2015?", "m", 3))
+
+    assert rewrites == [
+        "Who employed Jaime in 2015?",
+        "Which company did Jaime work for in 2015?",
+    ]
+
+
+def test_disconnect_returns_cancelled_answer_and_frees_gate(fake_pipeline, monkeypatch):
+    fake_pipeline.delay = 5
+    monkeypatch.setattr(chat, "DISCONNECT_POLL_INTERVAL", 0.01)
+
+    async def run():
+        state = {"gone": False}
+
+        async def is_disconnected():
+            return state["gone"]
+
+        task = asyncio.create_task(
+            chat.chat_async("hi", model="m", is_disconnected=is_disconnected)
+        )
+        await asyncio.sleep(0.05)
+        assert generation.get_gate("m").active == 1
+        state["gone"] = True
+        return await task
+
+    response = asyncio.run(run())
+
+    assert response["answer"] == "Request cancelled because the client disconnected."
+    assert "total_ms" in response["timings"]
+    assert generation.get_gate("m").active == 0
+
+
+def test_stage_timeout_returns_error_with_partial_timings(fake_pipeline, monkeypatch):
+    fake_pipeline.delay = 5
+    monkeypatch.setitem(chat.STAGE_TIMEOUTS, "generate", 0.05)
+
+    response = asyncio.run(chat.chat_async("hi", model="m"))
+
+    assert response["answer"] == "Error: generate stage exceeded 0.05s deadline"
+    assert response["model"] == "m"
+    for key in ("embed_ms", "search_ms", "retrieve_ms", "generate_ms", "total_ms"):
+        assert key in response["timings"]
+    assert generation.get_gate("m").active == 0
+
+
+def test_empty_store_skips_model_preload(fake_pipeline, monkeypatch):
+    monkeypatch.setattr(chat, "index_exists", lambda: False)
+
+    response = asyncio.run(chat.chat_async("hi", model="m"))
+
+    assert response["sources"] == []
+    assert fake_pipeline.calls == []
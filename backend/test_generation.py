@@ -0,0 +1,219 @@
+# backend/test_generation.py
+
+import asyncio
+
+import pytest
+
+import generation
+from generation import (
+    PRIORITY_BACKGROUND,
+    PRIORITY_INTERACTIVE,
+    FakeBackend,
+    GenerationBackend,
+    GenerationBusy,
+    ModelGate,
+)
+
+
+@pytest.fixture(autouse=True)
+def fresh_state(monkeypatch):
+    """Give every test its own gates and a fake backend"""
+    monkeypatch.setattr(generation, "_gates", {})
+    monkeypatch.setattr(generation, "_inflight", {})
+    backend = FakeBackend()
+    generation.set_backend(backend)
+    yield backend
+    generation.set_backend(None)
+
+
+def test_backend_base_is_abstract():
+    with pytest.raises(TypeError):
+        GenerationBackend()
+
+
+def test_gate_serves_priority_then_arrival():
+    async def run():
+        gate = ModelGate(1)
+        order = []
+
+        async def worker(name, priority):
+            await gate.acquire(priority, timeout=5)
+            order.append(name)
+            await asyncio.sleep(0.01)
+            gate.release()
+
+        await gate.acquire()
+        tasks = [
+            asyncio.create_task(worker("bg1", PRIORITY_BACKGROUND)),
+            asyncio.create_task(worker("fg1", PRIORITY_INTERACTIVE)),
+            asyncio.create_task(worker("bg2", PRIORITY_BACKGROUND)),
+            asyncio.create_task(worker("fg2", PRIORITY_INTERACTIVE)),
+        ]
+        await asyncio.sleep(0)
+        gate.release()
+        await asyncio.gather(*tasks)
+        return order, gate
+
+    order, gate = asyncio.run(run())
+    assert order == ["fg1", "fg2", "bg1", "bg2"]
+    assert gate.active == 0
+
+
+def test_gate_timeout_raises_busy_and_leaves_queue():
+    async def run():
+        gate = ModelGate(1)
+        await gate.acquire()
+        with pytest.raises(GenerationBusy):
+            await gate.acquire(timeout=0.01)
+        assert gate.load == 1
+
+        # The timed out waiter must not swallow the slot when it is released
+        gate.release()
+        await gate.acquire(timeout=0.01)
+        assert gate.active == 1
+
+    asyncio.run(run())
+
+
+def test_cancelled_waiter_and_request_free_their_places():
+    async def run():
+        gate = ModelGate(1)
+        await gate.acquire()
+        waiter = asyncio.create_task(gate.acquire(timeout=5))
+        await asyncio.sleep(0)
+        assert gate.load == 2
+
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        assert gate.load == 1
+
+        gate.release()
+        assert gate.active == 0
+
+    asyncio.run(run())
+
+
+def test_cancelling_generate_releases_slot(fresh_state):
+    fresh_state.delay = 5
+
+    async def run():
+        task = asyncio.create_task(generation.generate("hi", "m"))
+        await asyncio.sleep(0.01)
+        assert generation.get_gate("m").active == 1
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        return generation.get_gate("m").active
+
+    assert asyncio.run(run()) == 0
+
+
+def test_generate_uses_backend(fresh_state):
+    assert asyncio.run(generation.generate("hello", "m")) == "fake response"
+    assert fresh_state.calls == [("m", "hello")]
+
+
+def test_generate_busy_within_callers_budget(monkeypatch):
+    monkeypatch.setattr(generation, "MODEL_CONCURRENCY", 1)
+
+    async def run():
+        await generation.get_gate("m").acquire()
+        with pytest.raises(GenerationBusy):
+            await generation.generate("hi", "m", timeout=0.01)
+
+    asyncio.run(run())
+
+
+def test_generate_times_out_within_callers_budget(fresh_state):
+    fresh_state.delay = 5
+
+    async def run():
+        with pytest.raises(TimeoutError):
+            await generation.generate("hi", "m", timeout=0.05)
+        return generation.get_gate("m").active
+
+    assert asyncio.run(run()) == 0
+
+
+def test_identical_concurrent_prompts_share_one_request(fresh_state):
+    fresh_state.delay = 0.05
+
+    async def run():
+        return await asyncio.gather(
+            generation.generate("same", "m"),
+            generation.generate("same", "m"),
+            generation.generate("other", "m"),
+        )
+
+    assert asyncio.run(run()) == ["fake response"] * 3
+    assert sorted(fresh_state.calls) == [("m", "other"), ("m", "same")]
+    assert generation._inflight == {}
+
+
+def test_shared_request_survives_one_caller_cancelling(fresh_state):
+    fresh_state.delay = 0.05
+
+    async def run():
+        first = asyncio.create_task(generation.generate("same", "m"))
+        second = asyncio.create_task(generation.generate("same", "m"))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        result = await second
+        assert first.cancelled()
+        return result
+
+    assert asyncio.run(run()) == "fake response"
+    assert fresh_state.calls == [("m", "same")]
+
+
+def test_shared_request_cancelled_when_all_callers_leave(fresh_state):
+    fresh_state.delay = 5
+
+    async def run():
+        tasks = [asyncio.create_task(generation.generate("same", "m")) for _ in range(2)]
+        await asyncio.sleep(0.01)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await asyncio.sleep(0)
+        return generation.get_gate("m").active
+
+    assert asyncio.run(run()) == 0
+    assert generation._inflight == {}
+
+
+def test_http_backend_closes_client_from_previous_loop():
+    backend = generation.OllamaBackend(host="http://localhost:1")
+
+    async def get_client():
+        return await backend._get_client()
+
+    first = asyncio.run(get_client())
+    second = asyncio.run(get_client())
+    assert first.is_closed
+    assert not second.is_closed
+
+    generation.set_backend(backend)
+    asyncio.run(generation.close_backend())
+    assert second.is_closed
+    assert backend._client is None
+
+
+def test_route_model_without_config_keeps_requested_model():
+    assert generation.route_model("short?", "qwen3:4b") == "qwen3:4b"
+
+
+def test_route_model_by_length_and_load(monkeypatch):
+    monkeypatch.setattr(generation, "SMALL_MODEL", "small")
+    monkeypatch.setattr(generation, "LARGE_MODEL", "large")
+    monkeypatch.setattr(generation, "ROUTE_LENGTH_THRESHOLD", 10)
+    monkeypatch.setattr(generation, "MODEL_CONCURRENCY", 1)
+
+    long_question = "a much longer question"
+    assert generation.route_model("short?", "ignored") == "small"
+    assert generation.route_model(long_question, "ignored") == "large"
+
+    # A saturated large model sends long questions to the small one
+    generation.get_gate("large").active = 1
+    assert generation.route_model(long_question, "ignored") == "small"
@@ -0,0 +1,152 @@
+# backend/test_query.py
+
+from collections import OrderedDict
+
+import numpy as np
+import pytest
+
+import query
+
+QUESTION = [1.0, 0.0, 0.0]
+PARAPHRASE = [0.999, 0.01, 0.0]  # cosine ~0.9999 with QUESTION
+NEAR_MISS = [0.9, 0.43, 0.0]  # cosine ~0.90 with QUESTION
+OTHER = [0.0, 1.0, 0.0]
+
+
+class FakeDoc:
+    def __init__(self, text):
+        self.page_content = text
+        self.metadata = {"source": "docs/a.pdf", "page": 1}
+
+
+class FakeVectorstore:
+    """Returns k numbered chunks and counts searches"""
+
+    def __init__(self):
+        self.searches = 0
+
+    def similarity_search_with_score_by_vector(self, embedding, k):
+        self.searches += 1
+        return [(FakeDoc(f"search {self.searches} chunk {i}"), float(i)) for i in range(k)]
+
+
+class FakeFAISS:
+    loads = []
+
+    @classmethod
+    def load_local(cls, *args, **kwargs):
+        store = FakeVectorstore()
+        cls.loads.append(store)
+        return store
+
+
+def reset_cache(monkeypatch, size):
+    monkeypatch.setattr(query, "RETRIEVAL_CACHE_SIZE", size)
+    monkeypatch.setattr(query, "_cache_rows", OrderedDict())
+    monkeypatch.setattr(query, "_cache_keys", [None] * size)
+    monkeypatch.setattr(query, "_cache_results", [None] * size)
+    monkeypatch.setattr(query, "_cache_matrix", None)
+    monkeypatch.setattr(query, "_cache_generation", np.zeros(size, dtype=np.int64))
+    monkeypatch.setattr(query, "_cache_top_k", np.zeros(size, dtype=np.int32))
+
+
+@pytest.fixture(autouse=True)
+def fake_index(monkeypatch, tmp_path):
+    """Point the module at a temporary index file loaded by a fake FAISS"""
+    index_file = tmp_path / "index.faiss"
+    index_file.write_bytes(b"")
+    FakeFAISS.loads = []
+    monkeypatch.setattr(query, "INDEX_FILE", str(index_file))
+    monkeypatch.setattr(query, "FAISS", FakeFAISS)
+    monkeypatch.setattr(query, "_vectorstore", None)
+    monkeypatch.setattr(query, "_vectorstore_mtime", None)
+    monkeypatch.setattr(query, "_vectorstore_generation", 0)
+    monkeypatch.setattr(query, "_query_stats", {})
+    monkeypatch.setattr(query, "get_embeddings", lambda: None)
+    reset_cache(monkeypatch, 8)
+    return index_file
+
+
+def searches():
+    return sum(store.searches for store in FakeFAISS.loads)
+
+
+def test_paraphrase_above_threshold_hits_and_below_misses():
+    first = query.search_by_vector(QUESTION, 4, "Where did Jaime work?")
+    assert query.search_by_vector(PARAPHRASE, 4, "where did jaime work") == first
+    assert searches() == 1
+
+    query.search_by_vector(NEAR_MISS, 4, "where did rajiv work?")
+    assert searches() == 2
+
+
+def test_new_index_generation_never_serves_old_rows():
+    query.search_by_vector(QUESTION, 4, "question")
+    query.publish_index()
+
+    # Same mtime, but the published index is reloaded and the old row is not served
+    results = query.search_by_vector(QUESTION, 4, "question")
+    assert len(FakeFAISS.loads) == 2
+    assert results[0]["text"].startswith("search 1")
+    assert FakeFAISS.loads[1].searches == 1
+
+
+def test_stale_store_is_dropped_and_keeps_warmed_rows():
+    query.search_by_vector(QUESTION, 4, "popular", record=True)
+    _, old_generation = query._load_vectorstore_with_generation()
+
+    query.publish_index()
+    assert query.warm_retrieval_cache() == 1
+    assert list(query._cache_rows) == ["popular"]
+
+    # A slow request that searched the old index stores after the warm-up
+    query._cache_store("late", query._normalize(OTHER), 4, old_generation, [])
+    assert list(query._cache_rows) == ["popular"]
+
+
+def test_smaller_top_k_served_from_cache_and_larger_misses():
+    query.search_by_vector(QUESTION, 4, "question")
+
+    assert len(query.search_by_vector(QUESTION, 2, "question")) == 2
+    assert searches() == 1
+
+    assert len(query.search_by_vector(QUESTION, 6, "question")) == 6
+    assert searches() == 2
+
+
+def test_lru_eviction_when_cache_is_full(monkeypatch):
+    reset_cache(monkeypatch, 2)
+    query.search_by_vector(QUESTION, 4, "a")
+    query.search_by_vector(OTHER, 4, "b")
+    query.search_by_vector(QUESTION, 4, "a")  # hit, so "b" becomes least recently used
+
+    query.search_by_vector([0.0, 0.0, 1.0], 4, "c")
+
+    assert list(query._cache_rows) == ["a", "c"]
+
+
+def test_warm_replays_top_n_without_reembedding(monkeypatch):
+    def no_embedding(text):
+        raise AssertionError("warming must not re-embed queries")
+
+    monkeypatch.setattr(query, "embed_query", no_embedding)
+    for _ in range(3):
+        query.search_by_vector(QUESTION, 4, "frequent", record=True)
+    query.search_by_vector(OTHER, 4, "rare", record=True)
+
+    query.publish_index()
+    assert query.warm_retrieval_cache(top_n=1) == 1
+
+    assert list(query._cache_rows) == ["frequent"]
+    assert FakeFAISS.loads[-1].searches == 1
+
+
+def test_popularity_counts_paraphrases_and_skips_unrecorded():
+    query.search_by_vector(QUESTION, 4, "hello there", record=True)
+    query.search_by_vector(PARAPHRASE, 4, "hello there?", record=True)
+    query.search_by_vector(OTHER, 4, "generated rewrite")
+
+    assert list(query._query_stats) == ["hello there"]
+    count, _, vector = query._query_stats["hello there"]
+    assert count == 2
+    assert vector.dtype == np.float32
@@ -2,8 +2,7 @@ import os
 
 os.environ["KMP_DUPLICATE_LIB_OK"] = "TRUE"
 
-import subprocess
-import json
+import requests
 from query import load_index_and_meta, query_index
 
 SYSTEM_PROMPT = """
@@ -39,16 +38,22 @@ If the answer isn't in the PDFs, say:
 """
 
 
+OLLAMA_HOST = os.getenv("OLLAMA_HOST", "http://localhost:11434")
+if not OLLAMA_HOST.startswith("http"):
+    OLLAMA_HOST = f"http://{OLLAMA_HOST}"
+
+# Shared session so repeated questions reuse the same connection
+session = requests.Session()
+
+
 def ollama_generate(model, prompt):
-    process = subprocess.Popen(
-        ["ollama", "run", model],
-        stdin=subprocess.PIPE,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-        text=True,
+    response = session.post(
+        f"{OLLAMA_HOST}/api/generate",
+        json={"model": model, "prompt": prompt, "stream": False},
+        timeout=120,
     )
-    out, err = process.communicate(prompt)
-    return out
+    response.raise_for_status()
+    return response.json().get("response", "")
 
 
 def rag_answer(question, top_k=4, model="gemma3:4b"):